@@ -1,4 +1,7 @@
+import copy
 import logging.config
+import os
+from functools import lru_cache
 
 import yaml
 
@@ -8,14 +11,46 @@ import visma_qondor_integration_app.settings
 
 logger = logging.getLogger(__name__)
 
+# Use the libyaml based loader if it's available, it's considerably faster.
+_YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+@lru_cache(maxsize=1)
+def _load_logging_config(path, mtime=None):
+    """
+    Loads and parses the logging configuration file. The result is cached per file modification time (``mtime``), so
+    repeated :func:`create_app` calls only parse the file again if it has changed.
+    """
+    with open(path, "r") as f:
+        return yaml.load(f, Loader=_YamlLoader)
+
+
+# The (path, mtime) of the logging configuration that was last applied.
+_applied_logging_config = None
+
+
+def _configure_logging(path):
+    """
+    Applies the logging configuration file, unless the same version of the file has already been applied in this
+    process (e.g. when the app is re-created by the debug reloader or by tests).
+    """
+    global _applied_logging_config
+    key = (path, os.stat(path).st_mtime)
+    if key == _applied_logging_config:
+        return False
+
+    # dictConfig may mutate the dict it's given, so hand it a copy of the cached config.
+    logging.config.dictConfig(copy.deepcopy(_load_logging_config(*key)))
+    _applied_logging_config = key
+    return True
+
 
 def create_app():
     """
     Application factory for creating Flask apps.
     """
-    with open(visma_qondor_integration_app.settings.LOGGING_CONFIG, "r") as f:
-        global logger
-        logging.config.dictConfig(yaml.safe_load(f))
+    global logger
+    if _configure_logging(visma_qondor_integration_app.settings.LOGGING_CONFIG):
         logger = logging.getLogger(__name__)
         logger.debug("Logging configured.")
 
@@ -23,6 +58,14 @@ def create_app():
     app.config.from_object("visma_qondor_integration_app.settings")
     app.logger.debug("Configured Flask app.")
 
+    # Write any buffered service logs when the app context ends.
+    import visma_qondor_integration_app.database
+    app.teardown_appcontext(visma_qondor_integration_app.database.teardown_db)
+
+    # Write the session changes made during the request in one go.
+    import visma_qondor_integration_app.session
+    app.teardown_request(visma_qondor_integration_app.session.flush_sessions)
+
     register_blueprints(app)
     return app
 
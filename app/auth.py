@@ -1,12 +1,19 @@
 import logging
 
-from flask import url_for
+from flask import current_app, url_for
 from oauthlib.common import generate_token
 
+from .cache import TTLCache
 from .database import get_db
 
 logger = logging.getLogger(__name__)
 
+# Tokens are cached per (app_id, install_id) so that every new TokenManager doesn't have to hit the database. Misses are
+# cached as well, but for a shorter time.
+_TOKEN_CACHE = TTLCache(maxsize=1024, ttl=30)
+_TOKEN_CACHE_MISS_TTL = 5
+_MISSING = object()
+
 
 class TokenManager:
     def __init__(self, app_id, install_id, token=None):
@@ -15,15 +22,37 @@ class TokenManager:
         self._token = token
 
     def __call__(self, token):
+        if token is not None and token == self._token:
+            # Already stored (or loaded from the database), e.g. requests_oauthlib calling the token updater with the
+            # token that EloquaOAuth2Session.refresh_token() has already saved.
+            return
         get_db().set_token(self._app_id, self._install_id, token=token)
+        _TOKEN_CACHE.set((self._app_id, self._install_id), token)
         self._token = token
 
     def set(self, token):
         self(token)
 
+    def reload(self):
+        """
+        Reads the token from the database, bypassing the token cache (and the request's memoized installation
+        document), and updates the cache with it.
+
+        :return: The stored token or None.
+        """
+        token = get_db().load_token(self._app_id, self._install_id)
+        _TOKEN_CACHE.set((self._app_id, self._install_id), token, ttl=_TOKEN_CACHE_MISS_TTL if token is None else None)
+        self._token = token
+        return token
+
     def get(self):
         if self._token is None:
-            self._token = get_db().get_token(self._app_id, self._install_id)
+            key = (self._app_id, self._install_id)
+            token = _TOKEN_CACHE.get(key, _MISSING)
+            if token is _MISSING:
+                token = get_db().get_token(self._app_id, self._install_id)
+                _TOKEN_CACHE.set(key, token, ttl=_TOKEN_CACHE_MISS_TTL if token is None else None)
+            self._token = token
 
         return self._token
 
@@ -31,20 +60,30 @@ class TokenManager:
 # TODO Decouple this. This is required, but the actual url isn't used in anything else than the initial
 #  authentication process.
 def get_redirect_uri():
-    return url_for("eloqua_oauth.oauth_callback", _external=True, _scheme="https")
+    # The redirect URI doesn't change during the app's lifetime, so it's built once and stored in the app config.
+    uri = current_app.config.get("OAUTH_REDIRECT_URI")
+    if uri is None:
+        uri = url_for("eloqua_oauth.oauth_callback", _external=True, _scheme="https")
+        current_app.config["OAUTH_REDIRECT_URI"] = uri
+    return uri
 
 
 class OAuth2State:
+    __slots__ = ("session_id", "token")
+
     def __init__(self, session_id, token=None):
         self.session_id = session_id
         self.token = token or generate_token()
 
     def to_str(self):
-        return "{}.{}".format(self.session_id, self.token)
+        return f"{self.session_id}.{self.token}"
 
     @staticmethod
     def from_str(v: str):
-        if not isinstance(v, str):
+        try:
+            session_id, separator, token = v.partition(".")
+        except AttributeError:
             raise ValueError("Must be a string")
-        split = v.split(".")
-        return OAuth2State(session_id=split[0], token=split[1])
+        if not separator:
+            raise ValueError("Invalid state")
+        return OAuth2State(session_id=session_id, token=token)
@@ -2,8 +2,9 @@ import logging
 from abc import ABC
 from typing import Tuple, List, Dict
 
-from flask import Blueprint, current_app, abort, request, jsonify
+from flask import Blueprint, current_app, abort, request, jsonify, g
 from flask.views import View
+from werkzeug.utils import cached_property
 
 from ..database import get_db
 from ..decorators import validate_oauth_signature, required_args, require_authed_session
@@ -14,6 +15,17 @@ from ..util import ServiceRequest
 logger = logging.getLogger(__name__)
 
 
+def _request_form_dict() -> dict:
+    """
+    Returns the request's form as a flat dict. The conversion is done once per request and cached on ``g``.
+    """
+    form = getattr(g, "_form_dict", None)
+    if form is None:
+        form = request.form.to_dict(flat=True)
+        g._form_dict = form
+    return form
+
+
 class BaseEloquaView(View, ABC):
     """
     Base view for Eloqua cloud apps.
@@ -31,8 +43,9 @@ class BaseEloquaView(View, ABC):
     def default_response(self) -> Tuple[str, int]:
         raise NotImplementedError()
 
-    @property
-    def args(self):
+    @cached_property
+    def args(self) -> ServiceRequest:
+        # View instances are created per request, so the parsed request args can be cached on the instance.
         return ServiceRequest(request)
 
     @property
@@ -75,6 +88,10 @@ class BaseCreateView(BaseEloquaView, ABC):
         self.requires_configuration = requires_configuration
         self.instance_type = instance_type
         self.instance_config = instance_config
+        self._eloqua_configuration = {
+            "recordDefinition": self.record_definition,
+            "requiresConfiguration": self.requires_configuration,
+        }
 
     @property
     def instance_id(self):
@@ -92,10 +109,7 @@ class BaseCreateView(BaseEloquaView, ABC):
 
         :return: Eloqua configuration
         """
-        return {
-            "recordDefinition": self.record_definition,
-            "requiresConfiguration": self.requires_configuration,
-        }
+        return self._eloqua_configuration
 
     @property
     def default_response(self) -> Tuple[str, int]:
@@ -155,19 +169,19 @@ class BaseConfigureView(BaseEloquaView, ABC):
         self.install_id = install_id
         self.instance_id = instance_id
 
-        if request.method == "POST":
-            self.insert_service_log(extra={"posted_data": request.form})
+        method = request.method
+        if method == "POST":
+            self.insert_service_log(extra={"posted_data": _request_form_dict()})
         else:
             self.insert_service_log()
 
-        if request.method == "GET":
-            return self.get(app_id, install_id, instance_id, *args, **kwargs)
-
-        if request.method == "POST":
-            return self.post(app_id, install_id, instance_id, *args, **kwargs)
+        # Resolve the handler the same way flask.views.MethodView does.
+        handler = getattr(self, method.lower(), None) if method in self.methods else None
+        if handler is None:
+            # Method not allowed.
+            abort(405)
 
-        # Method not allowed.
-        abort(405)
+        return handler(app_id, install_id, instance_id, *args, **kwargs)
 
     def default_response(self, *args, **kwargs) -> Tuple[str, int]:
         return "No configurations available.", 200
@@ -211,6 +225,20 @@ class BaseNotifyView(BaseEloquaView, ABC):
     default_url_rule = "/notify/<string:app_id>/<string:install_id>/<string:instance_id>"
     decorators = [validate_oauth_signature]
 
+    @cached_property
+    def body(self) -> dict:
+        """
+        Returns the parsed JSON body of the notification request. Aborts with 400 if the body isn't a JSON object, so
+        that Eloqua retries the notification instead of the items getting lost.
+
+        :return: The notification request body
+        """
+        body = request.get_json(cache=True, silent=True)
+        if not isinstance(body, dict):
+            logger.warning("Invalid notification body.")
+            abort(400)
+        return body
+
     @property
     def total_results(self):
         """
@@ -218,7 +246,7 @@ class BaseNotifyView(BaseEloquaView, ABC):
 
         :return: Total results
         """
-        return request.json.get("totalResults", 0)
+        return self.body.get("totalResults", 0)
 
     @property
     def items(self) -> List[Dict]:
@@ -227,7 +255,7 @@ class BaseNotifyView(BaseEloquaView, ABC):
 
         :return: The items from the notification request
         """
-        return request.json.get("items", [])
+        return self.body.get("items", [])
 
     @property
     def execution_id(self) -> str:
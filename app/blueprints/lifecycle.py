@@ -9,6 +9,10 @@ from ..auth import get_redirect_uri, OAuth2State
 
 logger = logging.getLogger(__name__)
 
+# Request args that aren't saved with the installation data.
+_EXCLUDED_ARG_PREFIX = "oauth_"
+_EXCLUDED_ARGS = frozenset({"callback_url"})
+
 bp = Blueprint("eloqua_lifecycle", __name__, url_prefix="/eloqua/lifecycle")
 
 
@@ -23,7 +27,8 @@ def lifecycle_install():
                                              "redirect_url": request.args["callback_url"]},
                                       expires_in=300)
 
-    data = {k: v for k, v in request.args.items() if "oauth_" not in k and "callback_url" not in k}
+    data = {k: v for k, v in request.args.items()
+            if not k.startswith(_EXCLUDED_ARG_PREFIX) and k not in _EXCLUDED_ARGS}
     get_db().upsert_installation({"_name": current_app.config["CLOUD_APP_FRIENDLY_NAME"], **data})
 
     state = OAuth2State(session_id=session_id["_id"])
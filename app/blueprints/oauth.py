@@ -9,6 +9,7 @@ from requests_oauthlib import OAuth2Session
 from .common import BaseEloquaView
 from ..database import get_db
 from ..auth import OAuth2State, TokenManager, get_redirect_uri
+from ..session import invalidate_eloqua_session
 
 logger = logging.getLogger(__name__)
 
@@ -51,6 +52,7 @@ class BaseOAuthCallbackView(BaseEloquaView, ABC):
 
         # Need to explicitly save the token to the database; fetch_token doesn't update the token automatically.
         token_manager.set(token)
+        invalidate_eloqua_session(install_id)
 
         # Get the base URL for the installation.
         # TODO create a defaults file for default values, like the id endpoint
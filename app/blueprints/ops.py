@@ -1,36 +1,53 @@
 import logging
 
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Tuple
 
-from dea import EloquaClient
-from dea.bulk.definitions import SyncActionsDefinition
-from flask import Blueprint, request, flash, render_template
+from flask import Blueprint, request, flash, render_template, copy_current_request_context
 
 from .common import DefaultCreateView, DefaultDeleteView, BaseAsyncNotifyView, BaseConfigureView
 from ..database import get_db
-from ..eloqua_outbound_config import *
-from ..qondor_client import *
+from ..eloqua_outbound_config import fields
+from ..qondor_client import QondorClient
 from ..session import get_eloqua_session
-from ..settings import *
-from ..util import ServiceRequest
+from ..settings import QONDOR_PRIMARY_KEY
 
 logger = logging.getLogger(__name__)
 
+Project = namedtuple("Project", ("name", "id"))
+
+# The Eloqua configuration of a configured instance.
+_NEW_ELOQUA_CONFIG = {
+    "recordDefinition": fields,
+    "requiresConfiguration": False
+}
+
+
+def _fetch_projects(key):
+    """
+    Fetches the Qondor projects as a list of :class:`Project`. The projects themselves are cached by
+    :class:`QondorClient`.
+    """
+    qondor_client = QondorClient(key=key)
+    # add date time filter
+    return [Project(project["name"], str(project["id"])) for project in qondor_client.get_all_projects()]
+
 
 class NotifyView(BaseAsyncNotifyView, BaseConfigureView):
     default_name = "qondor_integration_notify"
 
     def process_items(self, app_id: str, install_id: str, instance_id: str, items: List[Dict], total_results,
                       execution_id: str = None) -> None:
-        args = ServiceRequest(request)
+        args = self.args
         args.instance_id = instance_id
         db = get_db()
         db.insert_service_log(self.default_name, {"total_results": total_results, "instance_id": instance_id,
                                                   "install_id": install_id, "app_id": app_id, **args.as_dict()})
         logger.debug("///////////////////////////////////////////////////////////////////////////////")
-        logger.debug("Received {0}s contacts".format(total_results))
-        logger.debug(items)
+        logger.debug("Received %ss contacts", total_results)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(items)
         db.insert_execution(app_id, install_id, instance_id, execution_id)
 
         # prepare for adding/updating contacts
@@ -45,20 +62,19 @@ class NotifyView(BaseAsyncNotifyView, BaseConfigureView):
         # create custom company participant field if not existed
         qondor_client.create_custom_company_participant_field(project_id=project_id)
         # get existing contacts to avoid re-adding them, as they should only be updated
-        existing_participant_data = qondor_client.get_all_participants_for_a_project(project_id=project_id)
-        existing_emails = [list(email.keys())[0] for email in existing_participant_data]
+        existing_participants = qondor_client.get_all_participants_for_a_project(project_id=project_id)
+
+        # don't need to send Eloqua ID in Qondor POST body
+        # this step is for updating contact status in Eloqua later
+        # after adding/updating contacts in Qondor
+        contact_ids = [contact.pop("id", None) for contact in items]
         # add/update contacts
-        for contact in items:
-            # don't need to send Eloqua ID in Qondor POST body
-            # this step is for updating contact status in Eloqua later
-            # after adding/updating contacts in Qondor
-            contact_id = contact.pop("id", None)
-            data_to_sync = {"id": contact_id}
+        contact_statuses = qondor_client.send_participants_bulk(project_id=project_id,
+                                                                existing_participants=existing_participants,
+                                                                records=items)
 
-            contact_status = qondor_client.send_single_participant(project_id=project_id,
-                                                                   existing_emails=existing_emails,
-                                                                   existing_participant_data=existing_participant_data,
-                                                                   data=contact)
+        for contact_id, contact_status in zip(contact_ids, contact_statuses):
+            data_to_sync = {"id": contact_id}
             if contact_status and isinstance(contact_status, bool):
                 success_contacts.append(data_to_sync)
             elif not contact_status and isinstance(contact_status, bool):
@@ -69,26 +85,33 @@ class NotifyView(BaseAsyncNotifyView, BaseConfigureView):
                 missing_project_id.append(contact_id)
 
         # update contact status after successfully or not sent to Qondor
-        if len(success_contacts):
-            logger.debug("Syncing {} success contacts".format(len(success_contacts)))
-            self.import_contact_status(success=True, contacts=success_contacts, execution_id=execution_id)
-        if len(error_contacts):
-            logger.debug("Syncing {} error contacts".format(len(error_contacts)))
-            self.import_contact_status(success=False, contacts=error_contacts, execution_id=execution_id)
-
-        logger.debug(
-            "Contacts failed to sent because no Qondor project id was specified: {0}".format(missing_project_id))
-        logger.debug("Contacts failed to sent because of other reasons: {0}".format(
-            [contact["id"] for contact in error_contacts]))
+        # a sync action can only set one status, so the success and error imports are separate but run concurrently
+        status_imports = [(success, contacts) for success, contacts in ((True, success_contacts),
+                                                                          (False, error_contacts)) if contacts]
+        if status_imports:
+            with ThreadPoolExecutor(max_workers=len(status_imports)) as executor:
+                futures = []
+                for success, contacts in status_imports:
+                    logger.debug("Syncing %s %s contacts", len(contacts), "success" if success else "error")
+                    futures.append(executor.submit(copy_current_request_context(self.import_contact_status),
+                                                   success=success, contacts=contacts, execution_id=execution_id,
+                                                   install_id=install_id, instance_id=instance_id))
+                for future in futures:
+                    future.result()
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Contacts failed to sent because no Qondor project id was specified: %s", missing_project_id)
+            logger.debug("Contacts failed to sent because of other reasons: %s",
+                         [contact["id"] for contact in error_contacts])
         logger.debug("Finish sending contact to Qondor")
         logger.debug("///////////////////////////////////////////////////////////////////////////////")
 
     @staticmethod
-    def import_contact_status(success, contacts, execution_id):
-        db = get_db()
-        execution_info = db.get_execution(execution_id)
-        install_id = execution_info["install_id"]
-        instance_id = execution_info["instance_id"]
+    def import_contact_status(success, contacts, execution_id, install_id, instance_id):
+        # Imported here to keep the module import light; only needed when syncing statuses back to Eloqua.
+        from dea import EloquaClient
+        from dea.bulk.definitions import SyncActionsDefinition
+        from dea.bulk.eml import eml
 
         logger.debug("---------------------------------------------")
         logger.debug("Start importing contact status to Eloqua")
@@ -116,14 +139,7 @@ class ConfigureView(BaseConfigureView):
     default_name = "qondor_integration_config"
 
     def get_projects(self):
-        project_info_pair = namedtuple("Project", ("name", "id"))
-        project_name_id_tuple_list = []
-        qondor_client = QondorClient(key=QONDOR_PRIMARY_KEY)
-        # add date time filter
-        projects = qondor_client.get_all_projects()
-        for project in projects:
-            project_name_id_tuple_list.append(project_info_pair(project["name"], str(project["id"])))
-        return project_name_id_tuple_list
+        return _fetch_projects(QONDOR_PRIMARY_KEY)
 
     @staticmethod
     def validate_form() -> Tuple[bool, List[str]]:
@@ -147,16 +163,14 @@ class ConfigureView(BaseConfigureView):
 
         # Get configurations from the database
         eloqua_config = self.get_eloqua_config()
-        new_eloqua_config = {
-            "recordDefinition": {**fields},
-            "requiresConfiguration": False
-        }
+        new_eloqua_config = _NEW_ELOQUA_CONFIG
 
         # Save Eloqua side configurations first (if needed)
         if new_eloqua_config != eloqua_config:
             logger.debug("Changes detected in Eloqua configuration")
-            logger.debug(f"Old: {eloqua_config}")
-            logger.debug(f"New: {new_eloqua_config}")
+            logger.debug("Old: %s", eloqua_config)
+            logger.debug("New: %s", new_eloqua_config)
+            from dea import EloquaClient
             eloqua_client = EloquaClient(session=get_eloqua_session(install_id))
             eloqua_client.put(
                 eloqua_client.url_for("/api/cloud/1.0/actions/instances/{instance_id}", instance_id=instance_id),
@@ -171,8 +185,9 @@ class ConfigureView(BaseConfigureView):
         return self.default_response()
 
     def default_response(self, form_values: dict = None) -> Tuple[str, int]:
-        logger.debug(f"Config: {self.get_config()}")
-        form_values = self.get_config() or form_values or {}
+        config = self.get_config()
+        logger.debug("Config: %s", config)
+        form_values = config or form_values or {}
         return render_template("config.html", subtitle="Instance configuration", projects=self.get_projects(),
                                form_values=form_values)
 
@@ -1,15 +1,38 @@
+import copy
 import datetime
 import logging
-from typing import Mapping, Iterable
+import threading
+import time
+from typing import Dict, Iterable, List, Mapping
 
 from bson.objectid import ObjectId
 from flask import g, current_app
-from pymongo import MongoClient, ReturnDocument
+from pymongo import ASCENDING, InsertOne, MongoClient, ReturnDocument
+from pymongo.errors import ConnectionFailure, PyMongoError
 
+from .cache import TTLCache
 from .enums import ServiceType
 
 logger = logging.getLogger(__name__)
 
+# Installation and service instance configurations change rarely, so they're cached for a short while across requests.
+# Entries are invalidated when this process updates them.
+_CONFIG_CACHE = TTLCache(maxsize=512, ttl=15)
+_MISSING = object()
+
+# The last seen version of each session, kept until the session expires. Served by get_session() if MongoDB can't be
+# reached, so that a short outage doesn't log everybody out.
+_LAST_SEEN_SESSIONS = TTLCache(maxsize=4096, ttl=3600)
+
+_mongo_client_lock = threading.Lock()
+_mongo_indexes_lock = threading.Lock()
+# Seconds to wait before trying to ensure the indexes again after the database couldn't be reached.
+_INDEX_RETRY_INTERVAL = 60
+
+# The fields and cursor batch size used when listing active instances.
+_ACTIVE_INSTANCE_PROJECTION = {"_id": 0, "app_id": 1, "install_id": 1, "instance_id": 1, "configuration.custom": 1}
+_ACTIVE_INSTANCE_BATCH_SIZE = 500
+
 
 def get_db():
     if "db" not in g:
@@ -18,11 +41,77 @@ def get_db():
     return g.db
 
 
+def teardown_db(exception=None):
+    """
+    Writes the buffered service logs of the context's Database object, if any. Registered as an app context teardown
+    function in create_app().
+    """
+    db = g.pop("db", None)
+    if db is not None:
+        try:
+            db.flush_service_logs()
+        except PyMongoError:
+            logger.exception("Couldn't write service logs.")
+
+
+def ensure_indexes(db: "Database"):
+    """
+    Ensures the collection indexes once per process, in a background thread so that no request waits for it. If the
+    database can't be reached, it's tried again (when the next Database object is created) after
+    _INDEX_RETRY_INTERVAL seconds.
+
+    :param db: The Database object to use.
+    """
+    app = current_app._get_current_object()
+    state = app.extensions.setdefault("mongo_indexes", {"ensured": False, "running": False, "next_attempt": 0})
+    with _mongo_indexes_lock:
+        if state["ensured"] or state["running"] or time.monotonic() < state["next_attempt"]:
+            return
+        state["running"] = True
+
+    def run():
+        try:
+            ensured = db._ensure_collection_indexes()
+        except Exception:
+            logger.exception("Couldn't ensure collection indexes.")
+            ensured = False
+
+        with _mongo_indexes_lock:
+            state["ensured"] = ensured
+            state["running"] = False
+            if not ensured:
+                state["next_attempt"] = time.monotonic() + _INDEX_RETRY_INTERVAL
+
+    threading.Thread(target=run, name="ensure-mongo-indexes", daemon=True).start()
+
+
+def get_mongo_client() -> MongoClient:
+    """
+    Returns the app's MongoClient. The client is created on first use and shared by all requests in the process, so
+    its connection pool is reused instead of reconnecting on every request.
+    """
+    client = current_app.extensions.get("mongo_client")
+    if client is None:
+        with _mongo_client_lock:
+            client = current_app.extensions.get("mongo_client")
+            if client is None:
+                config = current_app.config
+                client = MongoClient(config["DB_CONNECTION_STRING"],
+                                     maxPoolSize=config["CLOUD_APP_DB_MAX_POOL_SIZE"],
+                                     minPoolSize=config["CLOUD_APP_DB_MIN_POOL_SIZE"],
+                                     maxIdleTimeMS=config["CLOUD_APP_DB_MAX_IDLE_MS"],
+                                     waitQueueTimeoutMS=config["CLOUD_APP_DB_WAIT_QUEUE_TIMEOUT_MS"])
+                current_app.extensions["mongo_client"] = client
+                logger.debug("Created new MongoClient.")
+
+    return client
+
+
 # TODO Make less dependent on MongoDB
 # TODO Extract an abstract base class, use that to create database adapters
 class Database:
     def __init__(self):
-        self._client = MongoClient(current_app.config["DB_CONNECTION_STRING"])
+        self._client = get_mongo_client()
         self._database = self._client[current_app.config["CLOUD_APP_DB_NAME"]]
         self._installations = self._database["installations"]
         self._sessions = self._database["sessions"]
@@ -33,8 +122,24 @@ class Database:
         self._executions = self._database["executions"]
         self._data_dump_ttl = current_app.config["CLOUD_APP_DB_DATA_DUMP_TTL"]
         self._service_log_ttl = current_app.config["CLOUD_APP_DB_SERVICE_LOG_TTL"]
+        self._execution_ttl = current_app.config["CLOUD_APP_DB_EXECUTION_TTL"]
+        self._client_id = current_app.config.get("CLOUD_APP_CLIENT_ID")
+        # Data dumps are only saved in debug and testing modes (unless forced).
+        self._dump_enabled = current_app.config["DEBUG"] is True or current_app.config["TESTING"] is True
+
+        # Installation and service instance documents read during this request (Database objects live on g), keyed by
+        # (app_id, install_id) and (app_id, install_id, instance_id).
+        self._installation_docs = {}
+        self._instance_docs = {}
+        # Session documents read or written during this request, keyed by session ID. They aren't cached across
+        # requests: other worker processes may change or delete a session at any time.
+        self._session_docs = {}
+
+        # Service log entries waiting to be written, see flush_service_logs().
+        self._pending_service_logs = []
 
-        # self._ensure_collection_indexes()
+        # Indexes only need to be ensured once per process; see ensure_indexes().
+        ensure_indexes(self)
 
         logger.debug("Created new Database object.")
 
@@ -43,45 +148,127 @@ class Database:
 
     # Protected internal methods
 
-    def _ensure_collection_indexes(self):
-        if "_expires_at" not in self._sessions.index_information():
-            self._sessions.create_index("_expires_at", expireAt=True, expireAfterSeconds=0)
+    def _ensure_collection_indexes(self) -> bool:
+        """
+        Creates the collection indexes. Each index is created separately, so that a problem with one (e.g. an existing
+        index with conflicting options) doesn't prevent the others from being created.
 
-        if "_expires_at" not in self._cache.index_information():
-            self._cache.create_index("_expires_at", expireAt=True, expireAfterSeconds=0)
+        :return: False if the database couldn't be reached, True otherwise.
+        """
+        # create_index is a no-op if an identical index already exists. The lookup indexes come first, they matter most.
+        indexes = [
+            # Lookup indexes
+            (self._cache, [("data.oauth_nonce", ASCENDING), ("data.oauth_timestamp", ASCENDING)], {"background": True}),
+            (self._installations, [("app_id", ASCENDING), ("install_id", ASCENDING)], {"background": True}),
+            (self._instances, [("app_id", ASCENDING), ("install_id", ASCENDING), ("instance_id", ASCENDING)],
+             {"background": True}),
+            (self._executions, "execution_id", {"background": True}),
+            (self._instances, [("configuration.custom.status", ASCENDING),
+                               ("configuration.custom.frequency", ASCENDING)], {"background": True}),
+            # TTL indexes
+            (self._sessions, "_expires_at", {"expireAfterSeconds": 0}),
+            (self._cache, "_expires_at", {"expireAfterSeconds": 0}),
+            (self._data_dump, "created_at", {"expireAfterSeconds": self._data_dump_ttl}),
+            (self._service_logs, "_created_at", {"expireAfterSeconds": self._service_log_ttl}),
+            (self._executions, "_created_at", {"expireAfterSeconds": self._execution_ttl}),
+        ]
+
+        for collection, keys, kwargs in indexes:
+            try:
+                collection.create_index(keys, **kwargs)
+            except ConnectionFailure:
+                logger.exception("Couldn't connect to the database to ensure collection indexes.")
+                return False
+            except PyMongoError:
+                # Retrying won't help with these (e.g. IndexOptionsConflict), they need to be fixed in the database.
+                logger.exception("Couldn't create index %s on collection %s.", keys, collection.name)
 
-        if "created_at" not in self._data_dump.index_information():
-            self._data_dump.create_index("created_at", expireAfterSeconds=self._data_dump_ttl)
+        return True
 
-        if "_created_at" not in self._service_logs.index_information():
-            self._service_logs.create_index("_created_at", expireAfterSeconds=self._service_log_ttl)
+    @staticmethod
+    def _get_cached_config(key, load):
+        config = _CONFIG_CACHE.get(key, _MISSING)
+        if config is _MISSING:
+            config = load()
+            _CONFIG_CACHE.set(key, config)
+        return config
 
-        if "_created_at" not in self._executions.index_information():
-            self._executions.create_index("_created_at", expireAfterSeconds=datetime.timedelta(days=1).total_seconds())
+    def _invalidate_installation_config(self, app_id, install_id):
+        self._installation_docs.pop((app_id, install_id), None)
+        _CONFIG_CACHE.pop(("installation", app_id, install_id))
+
+    def _invalidate_service_instance_config(self, app_id, install_id, instance_id):
+        self._instance_docs.pop((app_id, install_id, instance_id), None)
+        _CONFIG_CACHE.pop(("custom", app_id, install_id, instance_id))
+        _CONFIG_CACHE.pop(("eloqua", app_id, install_id, instance_id))
+
+    def _get_installation_cached(self, app_id, install_id):
+        key = (app_id, install_id)
+        if key not in self._installation_docs:
+            # Only fetch the fields the accessors read.
+            self._installation_docs[key] = self._installations.find_one(
+                {"app_id": app_id, "install_id": install_id},
+                projection={"_id": 0, "config": 1, "base_url": 1, "oauth.token": 1})
+        return self._installation_docs[key]
+
+    def _get_instance_cached(self, app_id, install_id, instance_id):
+        key = (app_id, install_id, instance_id)
+        if key not in self._instance_docs:
+            # Only fetch the fields the accessors read.
+            self._instance_docs[key] = self._instances.find_one(
+                {"app_id": app_id, "install_id": install_id, "instance_id": instance_id},
+                projection={"_id": 0, "configuration": 1})
+        return self._instance_docs[key]
 
     @staticmethod
     def _get_expiration_date(expires_in):
         return datetime.datetime.utcnow() + datetime.timedelta(seconds=expires_in)
 
+    def _cache_session(self, doc):
+        """
+        Memoizes a session document for the rest of the request (and keeps it as the last seen version for as long as
+        the session is valid) and returns it.
+        """
+        if doc is not None:
+            # Store a copy so that changes made to the returned document don't leak into the caches.
+            cached = copy.deepcopy(doc)
+            self._session_docs[str(doc["_id"])] = cached
+            valid_for = (doc["_expires_at"] - datetime.datetime.utcnow()).total_seconds()
+            if valid_for > 0:
+                _LAST_SEEN_SESSIONS.set(str(doc["_id"]), cached, ttl=valid_for)
+        return doc
+
     @staticmethod
-    def _create_partial_embedded_update(prefix, data):
-        return {"{}.{}".format(prefix, k): v for k, v in data.items()}
+    def _iter_partial_embedded_update(prefix, data):
+        return ((f"{prefix}.{k}", v) for k, v in data.items())
 
     @staticmethod
     def _flatten_dict(d: Mapping, separator: str = ".") -> dict:
         out = {}
+        stack = [(None, d)]
 
-        def _flatten(x: Mapping, parents=()):
+        while stack:
+            prefix, x = stack.pop()
             for k, v in x.items():
-                if isinstance(v, Mapping) and v.items():
-                    _flatten(v, (*parents, k))
+                key = k if prefix is None else f"{prefix}{separator}{k}"
+                if isinstance(v, Mapping) and v:
+                    stack.append((key, v))
                 else:
-                    out[separator.join((*parents, k))] = v
-
-        _flatten(d)
+                    out[key] = v
 
         return out
 
+    @classmethod
+    def _create_cache_filter(cls, matching_data) -> dict:
+        if not isinstance(matching_data, Mapping):
+            return {"data": matching_data}
+
+        # Most lookups (e.g. OAuth nonces) only have scalar values, so there's nothing to flatten.
+        if matching_data and not any(isinstance(v, Mapping) for v in matching_data.values()):
+            return {f"data.{k}": v for k, v in matching_data.items()}
+
+        return cls._flatten_dict({"data": matching_data})
+
     # Installation method
 
     def upsert_installation(self, data, config=None):
@@ -92,6 +279,7 @@ class Database:
         self._installations.update_one(filter={"install_id": data["install_id"]},
                                        update={"$set": update_set},
                                        upsert=True)
+        self._invalidate_installation_config(data.get("app_id"), data["install_id"])
 
     def update_installation(self, app_id, install_id, data, config=None):
         update_set = {**data}
@@ -100,6 +288,7 @@ class Database:
 
         result = self._installations.update_one(filter={"install_id": install_id, "app_id": app_id},
                                                 update={"$set": update_set})
+        self._invalidate_installation_config(app_id, install_id)
         if result.matched_count < 1:
             logger.warning("Couldn't update installation data with app_id '%s' and install_id '%s'", app_id, install_id)
             return False
@@ -107,6 +296,7 @@ class Database:
 
     def delete_installation(self, app_id, install_id):
         result = self._installations.delete_one({"install_id": install_id, "app_id": app_id})
+        self._invalidate_installation_config(app_id, install_id)
         if result.deleted_count < 1:
             logger.warning("Couldn't delete installation data with install_id '%s' and app_id '%s'", install_id, app_id)
             return False
@@ -116,7 +306,11 @@ class Database:
         return self._installations.find_one({"app_id": app_id, "install_id": install_id})
 
     def get_installation_config(self, app_id, install_id):
-        installation = self.get_installation(app_id, install_id)
+        return self._get_cached_config(("installation", app_id, install_id),
+                                       lambda: self._get_installation_config(app_id, install_id))
+
+    def _get_installation_config(self, app_id, install_id):
+        installation = self._get_installation_cached(app_id, install_id)
         if installation is None:
             return installation
 
@@ -124,20 +318,29 @@ class Database:
         return config
 
     def get_base_url_for(self, app_id, install_id):
-        result = self.get_installation(app_id, install_id)
+        result = self._get_installation_cached(app_id, install_id)
         if result is None:
             return None
         else:
             return result.get("base_url")
 
     def get_token(self, app_id, install_id):
-        result = self.get_installation(app_id, install_id)
+        result = self._get_installation_cached(app_id, install_id)
         if result is None:
             return None
         else:
             return result.get("oauth", {}).get("token")
 
+    def load_token(self, app_id, install_id):
+        """
+        Reads the installation's token from the database, bypassing the installation document memoized for this
+        request.
+        """
+        self._installation_docs.pop((app_id, install_id), None)
+        return self.get_token(app_id, install_id)
+
     def set_token(self, app_id, install_id, token):
+        self._installation_docs.pop((app_id, install_id), None)
         return self._installations.update_one({"app_id": app_id, "install_id": install_id},
                                               {"$set": {"oauth.token": token}})
 
@@ -149,20 +352,19 @@ class Database:
 
         if eloqua_configuration is not None:
             if partial_update:
-                set_dict = {**set_dict,
-                            **self._create_partial_embedded_update("configuration.eloqua", eloqua_configuration)}
+                set_dict.update(self._iter_partial_embedded_update("configuration.eloqua", eloqua_configuration))
             else:
                 set_dict["configuration.eloqua"] = eloqua_configuration
 
         if configuration is not None:
             if partial_update:
-                set_dict = {**set_dict,
-                            **self._create_partial_embedded_update("configuration.custom", configuration)}
+                set_dict.update(self._iter_partial_embedded_update("configuration.custom", configuration))
             else:
                 set_dict["configuration.custom"] = configuration
 
         if instance_type is not None:
-            set_dict["type"] = instance_type.value
+            # ServiceType is a str enum, so it can be stored as is.
+            set_dict["type"] = instance_type
 
         update = {
             "$setOnInsert": {
@@ -186,6 +388,7 @@ class Database:
             },
             update,
             upsert=True)
+        self._invalidate_service_instance_config(app_id, install_id, instance_id)
         return result.matched_count > 0 or result.upserted_id is not None
 
     def delete_service_instance(self, app_id: str, install_id: str, instance_id: str):
@@ -194,6 +397,7 @@ class Database:
             "install_id": install_id,
             "instance_id": instance_id
         })
+        self._invalidate_service_instance_config(app_id, install_id, instance_id)
 
         return result.deleted_count > 0
 
@@ -209,24 +413,46 @@ class Database:
     def get_hourly_active_instances(self):
         result = self._instances.find(
             {"configuration.custom.status": "Activated",
-             "configuration.custom.frequency": "Hourly"})
+             "configuration.custom.frequency": "Hourly"},
+            projection=_ACTIVE_INSTANCE_PROJECTION).batch_size(_ACTIVE_INSTANCE_BATCH_SIZE)
 
         return result
 
     def get_daily_active_instances(self):
         result = self._instances.find(
             {"configuration.custom.status": "Activated",
-             "configuration.custom.frequency": "Daily"})
+             "configuration.custom.frequency": "Daily"},
+            projection=_ACTIVE_INSTANCE_PROJECTION).batch_size(_ACTIVE_INSTANCE_BATCH_SIZE)
 
         return result
 
     def get_weekly_active_instances(self):
         result = self._instances.find(
             {"configuration.custom.status": "Activated",
-             "configuration.custom.frequency": "Weekly"})
+             "configuration.custom.frequency": "Weekly"},
+            projection=_ACTIVE_INSTANCE_PROJECTION).batch_size(_ACTIVE_INSTANCE_BATCH_SIZE)
 
         return result
 
+    def get_active_instances_by_frequency(self, frequencies: Iterable[str]) -> Dict[str, List[dict]]:
+        """
+        Gets the activated instances for multiple frequencies with a single query.
+
+        :param frequencies: The frequencies, e.g. ``("Hourly", "Daily", "Weekly")``.
+        :return: The instances grouped by frequency. Every given frequency has a (possibly empty) list.
+        """
+        frequencies = list(frequencies)
+        grouped = {frequency: [] for frequency in frequencies}
+        result = self._instances.find(
+            {"configuration.custom.status": "Activated",
+             "configuration.custom.frequency": {"$in": frequencies}},
+            projection=_ACTIVE_INSTANCE_PROJECTION).batch_size(_ACTIVE_INSTANCE_BATCH_SIZE)
+
+        for instance in result:
+            grouped[instance["configuration"]["custom"]["frequency"]].append(instance)
+
+        return grouped
+
     def service_instance_exists(self, app_id, install_id, instance_id):
         count = self._instances.count_documents({
             "app_id": app_id,
@@ -236,25 +462,27 @@ class Database:
         return count > 0
 
     def get_service_instance_custom_configuration(self, app_id, install_id, instance_id):
-        result = self._instances.find_one({
-            "app_id": app_id,
-            "install_id": install_id,
-            "instance_id": instance_id
-        })
+        return self._get_cached_config(
+            ("custom", app_id, install_id, instance_id),
+            lambda: self._get_service_instance_custom_configuration(app_id, install_id, instance_id))
 
-        if result:
+    def _get_service_instance_custom_configuration(self, app_id, install_id, instance_id):
+        result = self._get_instance_cached(app_id, install_id, instance_id)
+
+        if result is not None:
             return result.get("configuration", {}).get("custom", {})
 
         return result
 
     def get_service_instance_eloqua_configuration(self, app_id, install_id, instance_id):
-        result = self._instances.find_one({
-            "app_id": app_id,
-            "install_id": install_id,
-            "instance_id": instance_id
-        })
+        return self._get_cached_config(
+            ("eloqua", app_id, install_id, instance_id),
+            lambda: self._get_service_instance_eloqua_configuration(app_id, install_id, instance_id))
 
-        if result:
+    def _get_service_instance_eloqua_configuration(self, app_id, install_id, instance_id):
+        result = self._get_instance_cached(app_id, install_id, instance_id)
+
+        if result is not None:
             return result.get("configuration", {}).get("eloqua", {})
 
         return result
@@ -273,38 +501,90 @@ class Database:
 
         if session_id is None:
             result = self._sessions.insert_one(doc)
-            return self._sessions.find_one({"_id": result.inserted_id})
+            return self._cache_session(self._sessions.find_one({"_id": result.inserted_id}))
         else:
+            self._session_docs.pop(str(session_id), None)
             result = self._sessions.find_one_and_update(filter={"_id": ObjectId(session_id)},
                                                         update={"$set": doc}, return_document=ReturnDocument.AFTER)
-            return result
+            return self._cache_session(result)
 
-    def get_session(self, session_id, refresh_session=True):
-        logger.debug("#### {}".format(session_id))
-        if isinstance(session_id, ObjectId):
-            _id = session_id
-        else:
-            _id = ObjectId(session_id)
-        result = self._sessions.find_one({"_id": ObjectId(session_id)})
+    def update_session_data(self, session_id, data: dict, removed: Iterable[str] = (), expires_in=3600):
+        """
+        Sets the given keys of the session data and removes the ``removed`` keys (leaving the other keys untouched), and
+        refreshes the expiration date.
 
-        if result is not None:
-            if refresh_session:
-                self._sessions.update_one(filter={"_id": _id},
-                                          update={
-                                              "$set": {
-                                                  "_expires_at": self._get_expiration_date(result["_expires_in"])
-                                              }
-                                          })
-            return result
-        else:
-            return None
+        :return: The updated session document, or None if the session doesn't exist (anymore).
+        """
+        doc = dict(self._iter_partial_embedded_update("data", data))
+        doc["_expires_in"] = expires_in
+        doc["_expires_at"] = self._get_expiration_date(expires_in)
+        update = {"$set": doc}
+        if removed:
+            update["$unset"] = {f"data.{key}": "" for key in removed}
+
+        self._session_docs.pop(str(session_id), None)
+        return self._cache_session(
+            self._sessions.find_one_and_update(filter={"_id": ObjectId(session_id)}, update=update,
+                                               return_document=ReturnDocument.AFTER))
+
+    def upsert_session(self, session_id, data, is_authed=False, expires_in=3600):
+        """
+        Replaces the session with the given ID by a fresh one, creating it if it doesn't exist (anymore), in a single
+        round-trip.
+
+        :return: The new session document.
+        """
+        _id = session_id if isinstance(session_id, ObjectId) else ObjectId(session_id)
+
+        self._session_docs.pop(str(_id), None)
+        return self._cache_session(self._sessions.find_one_and_replace(
+            filter={"_id": _id},
+            replacement={
+                "_expires_in": expires_in,
+                "_expires_at": self._get_expiration_date(expires_in),
+                "data": data,
+                "is_authed": is_authed
+            },
+            upsert=True,
+            return_document=ReturnDocument.AFTER))
+
+    def get_session(self, session_id, refresh_session=True):
+        logger.debug("Getting session %s", session_id)
+        cached = self._session_docs.get(str(session_id))
+        if cached is not None:
+            # Already read (and its expiration date refreshed) or written during this request.
+            return copy.deepcopy(cached)
+
+        _id = session_id if isinstance(session_id, ObjectId) else ObjectId(session_id)
+
+        try:
+            if not refresh_session:
+                return self._cache_session(self._sessions.find_one({"_id": _id}))
+
+            # Refresh the expiration date in the same round-trip; it's computed server-side from the stored _expires_in.
+            return self._cache_session(self._sessions.find_one_and_update(
+                filter={"_id": _id},
+                update=[{
+                    "$set": {
+                        "_expires_at": {"$add": ["$$NOW", {"$multiply": ["$_expires_in", 1000]}]}
+                    }
+                }],
+                return_document=ReturnDocument.AFTER))
+        except PyMongoError:
+            # Serve the last seen version of the session (if it hasn't expired) rather than failing the request. The
+            # next request tries the database again.
+            stale = _LAST_SEEN_SESSIONS.get(str(_id))
+            if stale is None:
+                raise
+            logger.warning("Couldn't read session %s from the database, using the last seen version.", _id,
+                           exc_info=True)
+            return copy.deepcopy(stale)
 
     def delete_session(self, session_id):
-        if isinstance(session_id, ObjectId):
-            _id = session_id
-        else:
-            _id = ObjectId(session_id)
+        _id = session_id if isinstance(session_id, ObjectId) else ObjectId(session_id)
 
+        self._session_docs.pop(str(_id), None)
+        _LAST_SEEN_SESSIONS.pop(str(_id))
         result = self._sessions.delete_one({"_id": _id})
         return result.deleted_count > 0
 
@@ -321,38 +601,46 @@ class Database:
         return result.inserted_id
 
     def find_one_from_cache(self, matching_data):
-        if isinstance(matching_data, Mapping):
-            return self._cache.find_one(self._flatten_dict({"data": matching_data}))
-        else:
-            return self._cache.find_one({"data": matching_data})
+        return self._cache.find_one(self._create_cache_filter(matching_data))
 
     def find_from_cache(self, matching_data) -> Iterable:
-        if isinstance(matching_data, Mapping):
-            return self._cache.find(self._flatten_dict({"data": matching_data}))
-        else:
-            return self._cache.find({"data": matching_data})
+        return self._cache.find(self._create_cache_filter(matching_data))
 
     # Data dump methods
 
     def insert_data_dump(self, description, data, app_id=None, install_id=None, instance_id=None, force_dump=False):
-        if current_app.config["DEBUG"] is True or current_app.config["TESTING"] is True or force_dump is True:
-            self._data_dump.insert_one({
-                "app_id": app_id or current_app.config.get("CLOUD_APP_CLIENT_ID"),
-                "install_id": install_id,
-                "instance_id": instance_id,
-                "description": description,
-                "created_at": datetime.datetime.utcnow(),
-                "data": data
-            })
+        if not self._dump_enabled and force_dump is not True:
+            return
+
+        self._data_dump.insert_one({
+            "app_id": app_id or self._client_id,
+            "install_id": install_id,
+            "instance_id": instance_id,
+            "description": description,
+            "created_at": datetime.datetime.utcnow(),
+            "data": data
+        })
 
     def insert_service_log(self, view_name, extra=None):
+        """
+        Adds a service log entry. The entries are buffered and written in bulk by :meth:`flush_service_logs` when the
+        app context is torn down.
+        """
         extra = dict(sorted((extra or {}).items()))
-        self._service_logs.insert_one({
+        self._pending_service_logs.append({
             "_created_at": datetime.datetime.utcnow(),
             "_view_name": view_name,
             **extra,
         })
 
+    def insert_service_logs_bulk(self, docs):
+        if docs:
+            self._service_logs.bulk_write([InsertOne(doc) for doc in docs], ordered=False)
+
+    def flush_service_logs(self):
+        docs, self._pending_service_logs = self._pending_service_logs, []
+        self.insert_service_logs_bulk(docs)
+
     # Executions
 
     def insert_execution(self, app_id, install_id, instance_id, execution_id):
@@ -377,13 +665,9 @@ class Database:
         """
         same with method get_service_instance_custom_configuration but get one level deeper: project (id)
         """
-        result = self._instances.find_one({
-            "app_id": app_id,
-            "install_id": install_id,
-            "instance_id": instance_id
-        })
+        result = self._get_instance_cached(app_id, install_id, instance_id)
 
-        if result:
+        if result is not None:
             return result.get("configuration", {}).get("custom", {}).get("project", None)
 
         return result
@@ -1,10 +1,11 @@
 import hashlib
 import hmac
 import logging
+import re
 import time
 from base64 import b64encode
 from functools import wraps
-from urllib.parse import quote_plus, quote
+from urllib.parse import quote_plus, quote, unquote_plus
 
 from flask import current_app, abort, request, jsonify
 
@@ -13,6 +14,9 @@ from .session import create_session
 
 logger = logging.getLogger(__name__)
 
+# Query string components consisting only of these (unreserved) characters are the same encoded and decoded.
+_UNRESERVED = re.compile(r"[A-Za-z0-9_.~-]*")
+
 
 def require_dev(f):
     @wraps(f)
@@ -47,6 +51,9 @@ def required_args(keys):
 
 
 def require_authed_session(_func=None, *, methods=None):
+    # Resolved once at decoration time; only a set membership test is left for each request.
+    methods = frozenset(methods) if methods is not None else None
+
     def decorator(f):
         @wraps(f)
         def wrapper_decorator(*args, **kwargs):
@@ -72,6 +79,9 @@ def require_authed_session(_func=None, *, methods=None):
 
 
 def validate_oauth_signature(_func=None, *, methods=None, create_new_session=False):
+    # Resolved once at decoration time; only a set membership test is left for each request.
+    methods = frozenset(methods) if methods is not None else None
+
     def decorator(f):
         @wraps(f)
         def wrapper_decorator(*args, **kwargs):
@@ -147,12 +157,18 @@ def _oauth_is_signature_valid():
         # E.g. with a "GET https://test.com/endpoint?foo=bar&x=1&url=http%3A%2F%2Ftest.com" request the query
         # parameters would be "foo=bar&x=1&url=http%3A%2F%2Fredirect.com" (before encoding)
 
-        # Flask request object automatically decodes the arguments, so we need to encode them back again since the
-        # original query string has them encoded and we need to encode the exact values given. Otherwise we get a
-        # signature mismatch.
-        logger.debug("Query parameters before encoding: %s", request.args.to_dict())
-        query_parameters = {k: quote(v).replace("+", "%20").replace("/", "%2F") for k, v in
-                            request.args.to_dict().items() if k != "oauth_signature"}
+        # The parameters are read from the raw query string. Flask's request.args are decoded, and we need the values
+        # encoded exactly as given, otherwise we get a signature mismatch. Most values (ids, nonces, timestamps) only
+        # contain unreserved characters and are used as is; anything else is decoded and encoded again.
+        query_parameters = {}
+        for pair in request.query_string.decode("utf-8", "replace").split("&"):
+            if not pair:
+                continue
+            k, _, v = pair.partition("=")
+            # Keys are used decoded, the same as request.args has them; only the values are encoded.
+            k = k if _UNRESERVED.fullmatch(k) else unquote_plus(k, encoding="utf-8", errors="replace")
+            if k != "oauth_signature" and k not in query_parameters:
+                query_parameters[k] = _encode_query_component(v)
         message += quote("&".join("{}={}".format(k, v)
                                   for (k, v) in sorted(query_parameters.items())))
         message = message.encode("utf-8")
@@ -184,9 +200,19 @@ def _oauth_is_signature_valid():
 
     # Validate oauth_signature against just created hash
     generated_signature = generate_signature()
-    if oauth_signature.encode("utf-8") != generated_signature:
+    if not hmac.compare_digest(oauth_signature.encode("utf-8"), generated_signature):
         logger.warning("OAuth signature validation failed: signature mismatch")
         logger.debug("Expected %s, got %s", generated_signature, oauth_signature.encode("utf-8"))
         return False
 
     return True
+
+
+def _encode_query_component(raw: str) -> str:
+    """
+    Percent-encodes a raw query string component the way the signature expects, i.e. the decoded value encoded with
+    all reserved characters (including "/") encoded and spaces as %20.
+    """
+    if _UNRESERVED.fullmatch(raw):
+        return raw
+    return quote(unquote_plus(raw, encoding="utf-8", errors="replace"), safe="")
@@ -1,7 +1,7 @@
 from enum import Enum
 
 
-class ServiceType(Enum):
+class ServiceType(str, Enum):
     ACTION = "ACTION"
     CONTENT = "CONTENT"
     DECISION = "DECISION"
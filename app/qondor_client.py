@@ -1,10 +1,40 @@
-import json
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
+from requests.adapters import HTTPAdapter
+
+from .cache import TTLCache
 
 logger = logging.getLogger(__name__)
 
+# Qondor data that rarely changes is cached for a short while, keyed by the subscription key (and project id).
+_PROJECTS_CACHE = TTLCache(maxsize=8, ttl=60)
+_COMPANY_FIELD_EXISTS_CACHE = TTLCache(maxsize=1024, ttl=300)
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def _get_session():
+    """
+    Returns the requests session shared by all QondorClients in the process, so that connections to Qondor are kept
+    alive and reused.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                session.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=50))
+                _session = session
+    return _session
+
+
+# The maximum number of concurrent requests in bulk operations.
+MAX_WORKERS = 16
+
 
 class QondorClient:
     def __init__(self, key):
@@ -14,23 +44,33 @@ class QondorClient:
         self.get_all_custom_participant_fields_url = "https://qondor.azure-api.net/Prod/Participant/v1/ParticipantField/GetForProject?projectId={0}"
         self.create_custom_company_participant_field_url = "https://qondor.azure-api.net/Prod/Participant/v1/ParticipantField"
         self.send_single_participant_url = "https://qondor.azure-api.net/Prod/Participant/v1/Participant"
-        self.headers = {"Content-Type": "application/json; charset=utf-8",
-                        "Ocp-Apim-Subscription-Key": self.key}
+        # The JSON bodies are sent with requests' json argument, which also sets the Content-Type header.
+        self.headers = {"Ocp-Apim-Subscription-Key": self.key}
+        self._session = _get_session()
 
     def get_all_projects(self, changed_after=None):
         if changed_after:
-            response = requests.get(url=self.get_all_projects_url + "?changedAfter={0}".format(changed_after),
-                                    headers=self.headers).json()
+            response = self._session.get(url=self.get_all_projects_url + "?changedAfter={0}".format(changed_after),
+                                         headers=self.headers).json()
         else:
-            response = requests.get(url=self.get_all_projects_url,
-                                    headers=self.headers).json()
-        return [{"id": project["id"], "name": project["name"]} for project in response]
+            projects = _PROJECTS_CACHE.get(self.key)
+            if projects is not None:
+                return projects
+            response = self._session.get(url=self.get_all_projects_url,
+                                         headers=self.headers).json()
+        projects = [{"id": project["id"], "name": project["name"]} for project in response]
+        if not changed_after:
+            _PROJECTS_CACHE.set(self.key, projects)
+        return projects
 
     def get_all_participants_for_a_project(self, project_id):
-        response = requests.get(url=self.get_all_participants_for_a_project_url.format(project_id),
-                                headers=self.headers).json()
-        return [{participant.get("email", None): participant.get("participantReference", None)}
-                for participant in response]
+        """
+        Gets the participants of a project as a dict of email -> participant reference.
+        """
+        response = self._session.get(url=self.get_all_participants_for_a_project_url.format(project_id),
+                                     headers=self.headers).json()
+        return {participant.get("email", None): participant.get("participantReference", None)
+                for participant in response}
 
     # the default company field by Qondor does not work
     # the custom field Visma wants therefore is "Kommune/virksomhet"
@@ -38,9 +78,16 @@ class QondorClient:
     # here is where you check for it to know if it exits or not
     # and then proceed creating one, if it doesn't
     def check_custom_company_participant_field_existence(self, project_id):
-        response = requests.get(url=self.get_all_custom_participant_fields_url.format(project_id),
-                                headers=self.headers).json()
-        return "Kommune/virksomhet" in [field["heading"] for field in response]
+        exists = _COMPANY_FIELD_EXISTS_CACHE.get((self.key, project_id))
+        if exists is None:
+            response = self._session.get(url=self.get_all_custom_participant_fields_url.format(project_id),
+                                         headers=self.headers).json()
+            exists = "Kommune/virksomhet" in [field["heading"] for field in response]
+            # Only cache positive results; a missing field may be created at any time (e.g. by another worker, or by a
+            # POST whose response we never saw), so it has to be checked again the next time.
+            if exists:
+                _COMPANY_FIELD_EXISTS_CACHE.set((self.key, project_id), True)
+        return exists
 
     def create_custom_company_participant_field(self, project_id):
         if not self.check_custom_company_participant_field_existence(project_id):
@@ -48,17 +95,25 @@ class QondorClient:
                 "projectId": project_id,
                 "heading": "Kommune/virksomhet"
             }
-            response = requests.post(url=self.create_custom_company_participant_field_url,
-                                     headers=self.headers,
-                                     data=json.dumps(data))
+            response = self._session.post(url=self.create_custom_company_participant_field_url,
+                                          headers=self.headers,
+                                          json=data)
             if response.status_code == 200:
+                _COMPANY_FIELD_EXISTS_CACHE.set((self.key, project_id), True)
                 return True
             else:
                 return False
         return None
         # decide more on output to catch all errors
 
-    def send_single_participant(self, project_id, existing_emails, existing_participant_data, data):
+    def send_single_participant(self, project_id, existing_participants, data):
+        """
+        Adds or updates a single participant in a Qondor project.
+
+        :param project_id: The Qondor project id.
+        :param existing_participants: The project's existing participants as a dict of email -> participant reference.
+        :param data: The participant data.
+        """
         if data:
             # if data is not in the right format, it cannot be add/update
             if not data.get("firstName", None) or not data.get("lastName", None):
@@ -78,12 +133,12 @@ class QondorClient:
             email = data.get("email", None)
 
             # add a new participant
-            if email not in existing_emails:
+            if email not in existing_participants:
                 data["projectId"] = project_id
                 try:
-                    response = requests.post(url=self.send_single_participant_url,
-                                             headers=self.headers,
-                                             data=json.dumps(data))
+                    response = self._session.post(url=self.send_single_participant_url,
+                                                  headers=self.headers,
+                                                  json=data)
                     if response.status_code != 200:
                         logger.debug("-----ERROR----- Adding participant to project {0}: {1}".
                                      format(project_id, data.get("email", None)))
@@ -96,12 +151,11 @@ class QondorClient:
 
             # update an existing participant
             else:
-                index = existing_emails.index(email)
-                data["reference"] = existing_participant_data[index][email]
+                data["reference"] = existing_participants[email]
                 try:
-                    response = requests.put(url=self.send_single_participant_url,
-                                            headers=self.headers,
-                                            data=json.dumps(data))
+                    response = self._session.put(url=self.send_single_participant_url,
+                                                 headers=self.headers,
+                                                 json=data)
                     if response.status_code != 200:
                         logger.debug("-----ERROR----- Updating participant to project {0}: {1}".
                                      format(project_id, data.get("email", None)))
@@ -114,3 +168,23 @@ class QondorClient:
 
         logger.debug("-----WARNING----- No project id to add participant")
         return None
+
+    def send_participants_bulk(self, project_id, existing_participants, records, max_workers=MAX_WORKERS):
+        """
+        Adds or updates multiple participants concurrently. See :meth:`send_single_participant`.
+
+        :param project_id: The Qondor project id.
+        :param existing_participants: The project's existing participants as a dict of email -> participant reference.
+        :param records: The participants' data.
+        :param max_workers: The maximum number of concurrent requests.
+        :return: The results of :meth:`send_single_participant`, in the same order as ``records``.
+        """
+        if not records:
+            return []
+
+        def send(data):
+            return self.send_single_participant(project_id=project_id, existing_participants=existing_participants,
+                                                data=data)
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(records))) as executor:
+            return list(executor.map(send, records))
@@ -1,17 +1,43 @@
 import logging
-from datetime import datetime
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timezone
+from functools import lru_cache
 
-from flask import session as flask_session, current_app
+from flask import session as flask_session, current_app, g
 from oauthlib.oauth2 import WebApplicationClient
+from pymongo.errors import PyMongoError
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
 from requests_oauthlib import OAuth2Session
 
 from .auth import TokenManager, get_redirect_uri
+from .cache import TTLCache
 from .database import get_db
 
 
 logger = logging.getLogger(__name__)
 
+_MISSING = object()
+
+# Eloqua sessions are reused per (app_id, install_id) so that their connection pools (and keep-alive connections)
+# survive between requests.
+_ELOQUA_SESSIONS = TTLCache(maxsize=256, ttl=300)
+
+# Token refreshes are serialized per (app_id, install_id); see EloquaOAuth2Session.refresh_token().
+_REFRESH_LOCKS = {}
+_REFRESH_LOCKS_LOCK = threading.Lock()
+# A stored token is only reused instead of refreshing if it's valid for at least this many more seconds.
+_REFRESH_MIN_VALIDITY = 30
+# How long to wait for another thread's refresh of the same token (in seconds) before refreshing without the lock.
+_REFRESH_LOCK_TIMEOUT = 5
+
+
+def _get_refresh_lock(app_id, install_id) -> threading.Lock:
+    with _REFRESH_LOCKS_LOCK:
+        return _REFRESH_LOCKS.setdefault((app_id, install_id), threading.Lock())
+
 
 class BaseSessionError(Exception):
     ...
@@ -29,25 +55,25 @@ class Session(dict):
     def __init__(self, initial_data: dict = None, is_authed: bool = False, create_new=False):
         session_id = flask_session.get("session_id", None)
         expires_at = flask_session.get("expires_at", None)
-        session_from_db = None
-
-        # Try to get the session from the database if a session ID is set.
-        if session_id:
-            logger.debug("Session ID found.")
-            session_from_db = get_db().get_session(session_id)
 
         # Check whether to create a new session or not; if yes, we skip the expiration/existence validations.
         if create_new:
-            if session_from_db is not None:
-                # Delete any existing sessions.
-                get_db().delete_session(session_id)
-                logger.debug("Deleted the existing session.")
-
-            # Create a new session.
-            session_from_db = get_db().set_session(initial_data or {}, is_authed=is_authed)
-            logger.debug("Created a new session.")
+            if session_id:
+                # Replace any existing session (or recreate it if it's already gone) in a single round-trip.
+                session_from_db = get_db().upsert_session(session_id, initial_data or {}, is_authed=is_authed)
+                logger.debug("Replaced the existing session.")
+            else:
+                session_from_db = get_db().set_session(initial_data or {}, is_authed=is_authed)
+                logger.debug("Created a new session.")
         else:
-            if (session_id and session_from_db is None) or (expires_at and datetime.utcnow().timestamp() >= expires_at):
+            session_from_db = None
+
+            # Try to get the session from the database if a session ID is set.
+            if session_id:
+                logger.debug("Session ID found.")
+                session_from_db = get_db().get_session(session_id)
+
+            if (session_id and session_from_db is None) or (expires_at and time.time() >= expires_at):
                 # Check if the session has expired or if the session is missing (i.e. expired as well).
                 logger.debug("Session has expired.")
                 flask_session.clear()
@@ -62,21 +88,113 @@ class Session(dict):
         super(Session, self).__init__(session_from_db["data"])
 
         self.id = str(session_from_db["_id"])
-        self.expires_at = session_from_db["_expires_at"]
+        # The expiration date as a UNIX timestamp; MongoDB returns naive UTC datetimes.
+        self.expires_at = int(session_from_db["_expires_at"].replace(tzinfo=timezone.utc).timestamp())
         self.is_authed = session_from_db["is_authed"]
+        # Keys changed (set or removed) since the last write; see flush().
+        self._dirty_keys = set()
 
         flask_session["session_id"] = self.id
-        flask_session["expires_at"] = int(self.expires_at.timestamp())
+        flask_session["expires_at"] = self.expires_at
 
     def __setitem__(self, key, value):
+        current = self.get(key, _MISSING)
+        # Nothing to write if the value didn't change. A container that was modified in place and assigned back is the
+        # same object as the current value though, so it has to be written anyway.
+        if current == value and not (current is value and isinstance(value, (dict, list, set))):
+            return
+
         super(Session, self).__setitem__(key, value)
-        result = get_db().set_session(self, self.id)
+        self._mark_dirty(key)
+
+    def __delitem__(self, key):
+        super(Session, self).__delitem__(key)
+        self._mark_dirty(key)
+
+    def pop(self, key, default=_MISSING):
+        if key in self:
+            value = super(Session, self).pop(key)
+            self._mark_dirty(key)
+            return value
+        if default is _MISSING:
+            raise KeyError(key)
+        return default
+
+    def popitem(self):
+        key, value = super(Session, self).popitem()
+        self._mark_dirty(key)
+        return key, value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def clear(self):
+        keys = list(self)
+        super(Session, self).clear()
+        for key in keys:
+            self._mark_dirty(key)
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def _mark_dirty(self, key):
+        if not self._dirty_keys:
+            # Make sure the changes get written when the request ends, even if nobody calls flush(). Keyed by the object
+            # since a request may hold several Session objects for the same session.
+            g.setdefault("_dirty_sessions", {})[id(self)] = self
+        self._dirty_keys.add(key)
+
+    @property
+    def is_dirty(self) -> bool:
+        return bool(self._dirty_keys)
+
+    def flush(self):
+        """
+        Writes the keys changed since the last flush to the database with a single partial update, i.e. sets the
+        changed keys and removes the deleted ones. Does nothing if no keys were changed.
+        """
+        if not self._dirty_keys:
+            return
+
+        changed = {key: self[key] for key in self._dirty_keys if key in self}
+        removed = [key for key in self._dirty_keys if key not in self]
+        self._dirty_keys.clear()
+        g.get("_dirty_sessions", {}).pop(id(self), None)
+
+        result = get_db().update_session_data(self.id, changed, removed=removed)
         if result is None:
             raise SessionExpired()
 
+    @contextmanager
+    def batch(self):
+        """
+        Writes all the changes made inside the block with a single update when the block exits, instead of waiting for
+        the end of the request.
+        """
+        yield self
+        self.flush()
+
     @property
     def has_expired(self) -> bool:
-        return datetime.utcnow() >= self.expires_at
+        return time.time() >= self.expires_at
+
+
+def flush_sessions(exception=None):
+    """
+    Writes the pending changes of the sessions modified during the request. Registered as a request teardown function
+    in create_app().
+    """
+    for session in list(g.pop("_dirty_sessions", {}).values()):
+        # The response has already been built at this point, so errors can only be logged.
+        try:
+            session.flush()
+        except BaseSessionError:
+            logger.warning("Session %s expired before its changes could be saved.", session.id)
+        except PyMongoError:
+            logger.exception("Couldn't save the changes of session %s.", session.id)
 
 
 def get_session():
@@ -88,28 +206,90 @@ def create_session(initial_data: dict = None, is_authed=False):
 
 
 class EloquaOAuth2Session(OAuth2Session):
-    def __init__(self, auto_refresh_auth=None, **kwargs):
+    def __init__(self, auto_refresh_auth=None, install_id=None, **kwargs):
         super().__init__(**kwargs)
         self.auto_refresh_auth = auto_refresh_auth
+        self.app_id = kwargs.get("client_id")
+        self.install_id = install_id
 
     def refresh_token(self, token_url, *args, **kwargs):
         if self.auto_refresh_auth is not None and kwargs.get("auth") is None:
             kwargs["auth"] = self.auto_refresh_auth
-        return super().refresh_token(token_url, *args, **kwargs)
+        if self.install_id is None:
+            return super().refresh_token(token_url, *args, **kwargs)
+
+        expired_access_token = (self.token or {}).get("access_token")
+        token_manager = self.token_updater if isinstance(self.token_updater, TokenManager) \
+            else TokenManager(self.app_id, self.install_id)
+
+        lock = _get_refresh_lock(self.app_id, self.install_id)
+        # Don't wait indefinitely for a refresh that's stuck; the token request itself has no timeout.
+        locked = lock.acquire(timeout=_REFRESH_LOCK_TIMEOUT)
+        if not locked:
+            logger.warning("Timed out waiting for the token refresh of installation %s.", self.install_id)
+
+        try:
+            # Another thread may have refreshed the token while we were waiting for the lock; if so, use that one
+            # instead of refreshing (and rotating the refresh token) again.
+            token = token_manager.reload()
+            if token and token.get("access_token") != expired_access_token:
+                # The stored token is newer than ours, so its refresh token is the current one (ours may already have
+                # been rotated).
+                self.token = token
+                if kwargs.get("refresh_token") is not None:
+                    kwargs["refresh_token"] = token.get("refresh_token")
+                if token.get("expires_at", 0) > time.time() + _REFRESH_MIN_VALIDITY:
+                    logger.debug("Token of installation %s was already refreshed.", self.install_id)
+                    return token
+
+            token = super().refresh_token(token_url, *args, **kwargs)
+            # Store the token before releasing the lock, so that the threads waiting for it find it. requests_oauthlib
+            # calls the token updater again afterwards; TokenManager skips that write since the token is unchanged.
+            token_manager(token)
+            return token
+        finally:
+            if locked:
+                lock.release()
 
 
 def get_eloqua_session(install_id):
     app_id = current_app.config["CLOUD_APP_CLIENT_ID"]
+    oauth = _ELOQUA_SESSIONS.get((app_id, install_id))
+    if oauth is None:
+        oauth = _create_eloqua_session(app_id, install_id)
+        _ELOQUA_SESSIONS.set((app_id, install_id), oauth)
+
+    return oauth
+
+
+def invalidate_eloqua_session(install_id):
+    """
+    Drops the cached Eloqua session of an installation, e.g. after the installation has been re-authorized.
+    """
+    _ELOQUA_SESSIONS.pop((current_app.config["CLOUD_APP_CLIENT_ID"], install_id))
+
+
+@lru_cache(maxsize=8)
+def _get_basic_auth(app_id, client_secret):
+    return HTTPBasicAuth(app_id, client_secret)
+
+
+def _create_eloqua_session(app_id, install_id):
+    cfg = current_app.config
     token_manager = TokenManager(app_id, install_id)
 
     oauth = EloquaOAuth2Session(
         client_id=app_id,
         client=WebApplicationClient(client_id=app_id),
         token_updater=token_manager,
-        auto_refresh_auth=HTTPBasicAuth(app_id, current_app.config["CLOUD_APP_CLIENT_SECRET"]),
-        auto_refresh_url=current_app.config["ELOQUA_ENDPOINT_TOKEN"],
+        install_id=install_id,
+        auto_refresh_auth=_get_basic_auth(app_id, cfg["CLOUD_APP_CLIENT_SECRET"]),
+        auto_refresh_url=cfg["ELOQUA_ENDPOINT_TOKEN"],
         redirect_uri=get_redirect_uri(),
         token=token_manager.get()
     )
+    adapter = HTTPAdapter(pool_connections=10, pool_maxsize=50)
+    oauth.mount("https://", adapter)
+    oauth.mount("http://", adapter)
 
     return oauth
@@ -1,4 +1,4 @@
-from datetime import datetime, timedelta
+from datetime import timedelta
 
 from environs import Env
 
@@ -47,9 +47,16 @@ with env.prefixed("CLOUD_APP_"):
 # The MongoDB database name.
 CLOUD_APP_DB_NAME = "visma-qondor-integration"
 
-# Debug data dump TTL.
-CLOUD_APP_DB_DATA_DUMP_TTL = timedelta(weeks=1).total_seconds()
-CLOUD_APP_DB_SERVICE_LOG_TTL = timedelta(days=30).total_seconds()
+# MongoDB connection pool settings. Each process (e.g. gunicorn worker) has its own pool.
+CLOUD_APP_DB_MAX_POOL_SIZE = env.int("CLOUD_APP_DB_MAX_POOL_SIZE", 200)
+CLOUD_APP_DB_MIN_POOL_SIZE = env.int("CLOUD_APP_DB_MIN_POOL_SIZE", 10)
+CLOUD_APP_DB_MAX_IDLE_MS = env.int("CLOUD_APP_DB_MAX_IDLE_MS", 300000)
+CLOUD_APP_DB_WAIT_QUEUE_TIMEOUT_MS = env.int("CLOUD_APP_DB_WAIT_QUEUE_TIMEOUT_MS", 2000)
+
+# Debug data dump, service log and execution TTLs, in seconds.
+CLOUD_APP_DB_DATA_DUMP_TTL = int(timedelta(weeks=1).total_seconds())
+CLOUD_APP_DB_SERVICE_LOG_TTL = int(timedelta(days=30).total_seconds())
+CLOUD_APP_DB_EXECUTION_TTL = int(timedelta(days=1).total_seconds())
 # --------------------------------
 
 # --- Other configurations ---
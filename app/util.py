@@ -1,29 +1,71 @@
+from functools import lru_cache
+
 from flask import Request, current_app
 
 
+@lru_cache(maxsize=None)
+def _build_request_methods(fields: tuple):
+    """
+    Generates ``__init__`` and ``as_dict`` methods specialized for the given fields, i.e. without any loops or
+    intermediate dicts. Used by _BaseRequestMeta.
+
+    :param fields: The field names (must be valid identifiers).
+    :return: A (__init__, as_dict) tuple.
+    """
+    for field in fields:
+        if not field.isidentifier():
+            raise ValueError(f"Invalid request field name: {field!r}")
+
+    lines = ["def __init__(self, request, **additional_args):", "    a = request.args"]
+    lines += [f"    self.{field} = additional_args.get({field!r}, a.get({field!r}))" for field in fields]
+    lines += ["", "", "def as_dict(self, include_nones=False):", "    output = {"]
+    lines += [f"        {field!r}: self.{field}," for field in fields]
+    lines += [
+        "    }",
+        "    if not include_nones:",
+        "        return {k: v for (k, v) in output.items() if v is not None}",
+        "    return output",
+    ]
+
+    namespace = {}
+    exec("\n".join(lines), namespace)
+    return namespace["__init__"], namespace["as_dict"]
+
+
 class _BaseRequestMeta(type):
     """
-    Metaclass for _BaseRequest. Appends all of the fields from the class' nested Meta class and its parents to
-    __all_fields.
+    Metaclass for _BaseRequest. Sets the class' _all_fields to the fields from its nested Meta class, merged with the
+    fields of its parents unless Meta.append is False.
     """
-    __all_fields = set()
 
     def __new__(mcs, name, bases, attrs):
         # Get the Meta class.
         meta = attrs.get("Meta", None)
-        append = True
         # Check for the append attribute, i.e. whether the class should append the fields or just replace them entirely.
-        if hasattr(meta, "append"):
-            append = meta.append
+        append = getattr(meta, "append", True)
+
+        parent_fields = frozenset().union(*(getattr(base, "_all_fields", ()) for base in bases))
         # Check for the fields attribute which tells which fields to use.
         if hasattr(meta, "fields"):
-            if append:
-                mcs.__all_fields = mcs.__all_fields.union(meta.fields)
-            else:
-                mcs.__all_fields = meta.fields
+            all_fields = parent_fields | frozenset(meta.fields) if append else frozenset(meta.fields)
+        else:
+            all_fields = parent_fields
+
+        if "__slots__" not in attrs:
+            # Request objects are created for every request, so keep them dict-free; the parents already have slots for
+            # their own fields.
+            attrs["__slots__"] = tuple(sorted(all_fields - parent_fields))
 
         new = super(_BaseRequestMeta, mcs).__new__(mcs, name, bases, attrs)
-        new._all_fields = mcs.__all_fields
+        new._all_fields = all_fields
+
+        # Replace the generic (loop based) methods with ones generated for this class' fields, unless the class defines
+        # its own.
+        init, as_dict = _build_request_methods(tuple(sorted(all_fields)))
+        if bases and "__init__" not in attrs:
+            new.__init__ = init
+        if bases and "as_dict" not in attrs:
+            new.as_dict = as_dict
 
         return new
 
@@ -49,7 +91,7 @@ class _BaseRequest(metaclass=_BaseRequestMeta):
     site_id: int
     site_name: str
 
-    _all_fields: set
+    _all_fields: frozenset
 
     def __init__(self, request: Request, **additional_args):
         all_args = {**request.args, **additional_args}